@@ -1,23 +1,40 @@
 # -*- coding: utf-8 -*-
+import hmac
 import os
-import json
 import logging
+import logging.handlers
+import queue
 import urllib.parse
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from typing import Optional, Dict, Any, Tuple
 
-import requests
-from fastapi import FastAPI, Request, Query, Header, HTTPException
-from fastapi.responses import JSONResponse
+import httpx
+import orjson
+from fastapi import FastAPI, Request, Query, HTTPException, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
 
 # ---------------- 日志初始化（尽量少改，支持环境变量控制级别） ----------------
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# %(created).3f 而不是 %(asctime)s：时间字符串格式化是格式器里最贵的一步
 logging.basicConfig(
     level=getattr(logging, LOG_LEVEL, logging.INFO),
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+    format="%(created).3f [%(levelname)s] %(name)s: %(message)s"
 )
 logger = logging.getLogger("acr-notifier")
 
-app = FastAPI(title="ACR Webhook → MeoW Notifier", version="1.0.0")
+# 异步日志：请求线程只往队列里塞记录就立即返回，格式化和阻塞的
+# write() 由后台监听线程完成，不再占用事件循环。
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, *logging.getLogger().handlers)
+_log_listener.start()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False
+
+app = FastAPI(title="ACR Webhook → MeoW Notifier", version="1.0.0", default_response_class=ORJSONResponse)
+# 超过 1KB 的响应（比如带完整 MeoW 回执的 /payload 应答）做 gzip 压缩
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 # ============= 可配置项（环境变量） =============
 MIAO_NICKNAME = os.getenv("MIAO_NICKNAME", "")  # 你的 MeoW 昵称（必须在 MeoW 上先存在）
@@ -25,14 +42,65 @@ MIAO_API_BASE = os.getenv("MIAO_API_BASE", "https://api.chuckfang.com")  # MeoW
 DEFAULT_TITLE = os.getenv("DEFAULT_TITLE", "MeoW")  # 默认标题
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # 可选：共享密钥，校验 ?secret=xxx
 DEFAULT_JUMP_URL = os.getenv("DEFAULT_JUMP_URL", "")  # 可选：点开通知跳转链接（比如你的服务地址）
+MAX_PAYLOAD_BYTES = int(os.getenv("MAX_PAYLOAD_BYTES", 1024 * 1024))  # /payload 请求体上限，默认 1MB
+
+# 环境变量在进程生命周期内不变，端点常量导入时折叠一次，
+# 热路径上不再重复 rstrip + quote
+_MIAO_BASE = MIAO_API_BASE.rstrip("/")
+# 昵称来来回回就那几个：quote 的逐字符扫描按昵称缓存，重复出现零开销
+_quote_nickname = lru_cache(maxsize=64)(urllib.parse.quote)
+_DEFAULT_ENDPOINT = f"{_MIAO_BASE}/{_quote_nickname(MIAO_NICKNAME)}"
+_SECRET_REQUIRED = bool(WEBHOOK_SECRET)
+_SECRET_BYTES = WEBHOOK_SECRET.encode()
+
+# ============= 工具：解析 ACR 事件里的仓库字段 =============
+def _parse_repo(repo: Dict[str, Any]) -> Tuple[str, str]:
+    """返回 (repo_full, region)；repo_full_name 存在时不再拼 namespace/name。"""
+    repo_full = repo.get("repo_full_name")
+    if not repo_full:
+        repo_full = f"{repo.get('namespace', '')}/{repo.get('name', '')}".strip("/")
+    return repo_full, repo.get("region", "")
+
+# ============= 工具：校验 ?secret=xxx =============
+def _check_secret(secret: Optional[str]) -> None:
+    """未配置 WEBHOOK_SECRET 时直接放行；比较用 compare_digest 防时序侧信道。"""
+    if not _SECRET_REQUIRED:
+        return
+    if not secret or not hmac.compare_digest(secret.encode(), _SECRET_BYTES):
+        logger.warning("[check_secret] secret invalid")
+        raise HTTPException(status_code=401, detail="secret invalid")
+
+# ============= HTTP 客户端（异步，随应用启动/关闭） =============
+# 同步 requests 会把整个事件循环堵住（最长 10 秒超时），改用 httpx.AsyncClient
+# 让 MeoW 推送与其他请求并发进行。
+client: Optional[httpx.AsyncClient] = None
+
+@app.on_event("startup")
+async def _startup_client():
+    global client
+    # 连接池 + keep-alive：突发的 ACR 事件复用同一批 TLS 连接，
+    # 省掉每次推送的 TCP/TLS 握手；连接层错误自动重试 2 次。
+    client = httpx.AsyncClient(
+        timeout=10,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=10),
+        transport=httpx.AsyncHTTPTransport(retries=2),
+    )
+
+@app.on_event("shutdown")
+async def _shutdown_client():
+    if client is not None:
+        await client.aclose()
 
 # ============= 工具：把通知发到 MeoW =============
-def push_meow(nickname: str, title: str, msg: str, url: Optional[str] = None) -> Dict[str, Any]:
+async def push_meow(nickname: str, title: str, msg: str, url: Optional[str] = None) -> Dict[str, Any]:
     """
     使用 MeoW 的 POST JSON 方式推送（更稳，不用担心中文 URL 编码）。
     文档：https://www.chuckfang.com/MeoW/api_doc.html
     """
-    endpoint = f"{MIAO_API_BASE.rstrip('/')}/{urllib.parse.quote(nickname)}"
+    if nickname == MIAO_NICKNAME:
+        endpoint = _DEFAULT_ENDPOINT
+    else:
+        endpoint = f"{_MIAO_BASE}/{_quote_nickname(nickname)}"
     payload = {
         "title": title or DEFAULT_TITLE,
         "msg": msg,
@@ -40,21 +108,34 @@ def push_meow(nickname: str, title: str, msg: str, url: Optional[str] = None) ->
     if url:
         payload["url"] = url
 
-    logger.info("[push_meow] endpoint=%s payload=%s", endpoint, payload)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[push_meow] endpoint=%s payload=%s", endpoint, payload)
     try:
-        resp = requests.post(endpoint, json=payload, timeout=10)
+        # orjson 一次性编码成 bytes，绕过 httpx 内置的纯 Python JSON 编码器
+        resp = await client.post(
+            endpoint,
+            content=orjson.dumps(payload),
+            headers={"content-type": "application/json"},
+        )
         ctype = resp.headers.get("content-type", "")
         data = resp.json() if ctype.startswith("application/json") else {"text": resp.text}
-        logger.info("[push_meow] status=%s resp=%s", resp.status_code, data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[push_meow] status=%s resp=%s", resp.status_code, data)
         return {"http_status": resp.status_code, "resp": data}
     except Exception as e:
         logger.exception("[push_meow] exception occurred")
         return {"http_status": 0, "error": str(e)}
 
 # ============= 健康检查 =============
+# 内容全是启动时捕获的常量；预序列化一次，探活请求直接复用同一个 Response
+_HEALTH_RESPONSE = Response(
+    content=orjson.dumps({"ok": True, "nickname": MIAO_NICKNAME, "api_base": MIAO_API_BASE}),
+    media_type="application/json",
+)
+
 @app.get("/health")
 async def health():
-    return {"ok": True, "nickname": MIAO_NICKNAME, "api_base": MIAO_API_BASE}
+    return _HEALTH_RESPONSE
 
 # ============= 手动触发（GET/POST） =============
 @app.get("/notify")
@@ -66,62 +147,64 @@ async def notify_get(
     secret: Optional[str] = Query(None, description="如果配置了 WEBHOOK_SECRET，需匹配")
 ):
     logger.info("[GET /notify] title=%s msg=%s url=%s nickname=%s", title, msg, url, nickname)
-    if WEBHOOK_SECRET and secret != WEBHOOK_SECRET:
-        logger.warning("[GET /notify] secret invalid")
-        raise HTTPException(status_code=401, detail="secret invalid")
-    res = push_meow(nickname or MIAO_NICKNAME, title, msg, url or DEFAULT_JUMP_URL or None)
+    _check_secret(secret)
+    res = await push_meow(nickname or MIAO_NICKNAME, title, msg, url or DEFAULT_JUMP_URL or None)
     return res
 
+class NotifyBody(BaseModel):
+    """POST /notify 请求体；解析和校验由 Pydantic 一次完成，缺 msg 直接 422。"""
+    title: str = DEFAULT_TITLE
+    msg: str = Field(min_length=1)
+    url: Optional[str] = None
+    nickname: Optional[str] = None
+
 @app.post("/notify")
-async def notify_post(body: Dict[str, Any], secret: Optional[str] = Query(None)):
-    """
-    JSON 格式：
-    {
-      "title": "可选标题",
-      "msg": "必填内容",
-      "url": "可选链接",
-      "nickname": "可选，缺省用环境变量"
-    }
-    """
+async def notify_post(body: NotifyBody, secret: Optional[str] = Query(None)):
     logger.info("[POST /notify] body=%s", body)
-    if WEBHOOK_SECRET and secret != WEBHOOK_SECRET:
-        logger.warning("[POST /notify] secret invalid")
-        raise HTTPException(status_code=401, detail="secret invalid")
-
-    title = str(body.get("title") or DEFAULT_TITLE)
-    msg = str(body.get("msg") or "")
-    if not msg:
-        logger.warning("[POST /notify] msg is required")
-        raise HTTPException(status_code=400, detail="msg is required")
-    url = body.get("url") or DEFAULT_JUMP_URL or None
-    nickname = body.get("nickname") or MIAO_NICKNAME
-
-    res = push_meow(nickname, title, msg, url)
+    _check_secret(secret)
+    res = await push_meow(
+        body.nickname or MIAO_NICKNAME,
+        body.title,
+        body.msg,
+        body.url or DEFAULT_JUMP_URL or None,
+    )
     return res
 
 # ============= Webhook：接收 ACR 推送 =============
+# 同一个 handler 挂两条路径：根路径直接命中，不走转发包装函数
+@app.post("/")
 @app.post("/payload")
-async def acr_payload(request: Request, secret: Optional[str] = Query(None), user_agent: Optional[str] = Header(None)):
+async def acr_payload(request: Request):
     """
     接收阿里云 ACR Webhook（示例载荷见你的描述）
     将其格式化后转发到 MeoW 消息推送。
     """
-    # 先读取原始报文，便于调试（重要：读一次后用本地变量解析）
+    # user_agent / secret 只用来回显和比对，直接从 scope 里取，
+    # 不走 FastAPI 的依赖解析 + Pydantic 校验
+    user_agent = request.headers.get("user-agent")
+    secret = request.query_params.get("secret")
+
+    # 超大报文先按 Content-Length 拒掉，不进内存
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_PAYLOAD_BYTES:
+        logger.warning("[POST /payload] payload too large: %s bytes", content_length)
+        raise HTTPException(status_code=413, detail="payload too large")
+
+    # 读原始 bytes，orjson 直接解析，不做整体 UTF-8 解码（省一次全量拷贝）
     raw_bytes = await request.body()
-    raw_text = raw_bytes.decode("utf-8", errors="ignore")
-    logger.info("[POST /payload] UA=%s", user_agent)
-    logger.info("[POST /payload] RAW=%s", raw_text[:4000])  # 防爆日志，最多打印 4000 字符
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[POST /payload] UA=%s", user_agent)
+        # 防爆日志，最多打印 4000 字符；DEBUG 以上级别直接跳过解码+格式化
+        logger.debug("[POST /payload] RAW=%s", raw_bytes[:4000].decode("utf-8", errors="ignore"))
 
-    if WEBHOOK_SECRET and secret != WEBHOOK_SECRET:
-        logger.warning("[POST /payload] secret invalid")
-        raise HTTPException(status_code=401, detail="secret invalid")
+    _check_secret(secret)
 
-    # 尝试按 JSON 解析；失败则按 text 兜底
+    # 尝试按 JSON 解析；失败则按 text 兜底（只有这条慢路径才需要解码）
     try:
-        data = json.loads(raw_text) if raw_text else {}
+        data = orjson.loads(raw_bytes) if raw_bytes else {}
     except Exception:
         logger.warning("[POST /payload] invalid JSON, fallback to raw text")
-        data = {"raw": raw_text}
+        data = {"raw": raw_bytes.decode("utf-8", errors="ignore")}
 
     push_data = data.get("push_data", {}) if isinstance(data, dict) else {}
     repo = data.get("repository", {}) if isinstance(data, dict) else {}
@@ -129,29 +212,51 @@ async def acr_payload(request: Request, secret: Optional[str] = Query(None), use
     tag = push_data.get("tag", "")
     digest = push_data.get("digest", "")
     pushed_at = push_data.get("pushed_at", "")
-    repo_full = repo.get("repo_full_name") or f"{repo.get('namespace','')}/{repo.get('name','')}".strip("/")
-    region = repo.get("region", "")
+    repo_full, region = _parse_repo(repo)
 
-    # 组装标题与内容
+    # 组装标题与内容：标签和字段值分开 append，一次 join 直接出正文，
+    # 不生成每行的 f-string 临时串（标签自带换行，最后去掉开头那个）
     title = f"镜像自动构建完成: {repo_full}:{tag or 'latest'}"
-    msg_lines = [
-        f"仓库：{repo_full}" if repo_full else None,
-        f"区域：{region}" if region else None,
-        f"Tag：{tag}" if tag else None,
-        f"Digest：{digest}" if digest else None,
-        f"时间：{pushed_at}" if pushed_at else None,
-    ]
-    msg = "\n".join([x for x in msg_lines if x]) or "收到 ACR 推送"
+
+    chunks = []
+    append = chunks.append
+    if repo_full:
+        append("\n仓库：")
+        append(repo_full)
+    if region:
+        append("\n区域：")
+        append(region)
+    if tag:
+        append("\nTag：")
+        append(tag)
+    if digest:
+        append("\nDigest：")
+        append(digest)
+    if pushed_at:
+        append("\n时间：")
+        append(pushed_at)
+
+    msg = "".join(chunks)[1:] if chunks else "收到 ACR 推送"
 
     # 生成一个可点击的跳转链接（可选）
     jump_url = DEFAULT_JUMP_URL or repo_full  # 你也可以换成 ACR 控制台具体地址
 
     logger.info("[POST /payload] title=%s msg=%s jump_url=%s", title, msg, jump_url)
-    res = push_meow(MIAO_NICKNAME, title or DEFAULT_TITLE, msg, jump_url)
-    return JSONResponse(content={"ok": True, "meow_result": res, "user_agent": user_agent}, status_code=200)
+    res = await push_meow(MIAO_NICKNAME, title or DEFAULT_TITLE, msg, jump_url)
+    return ORJSONResponse(content={"ok": True, "meow_result": res, "user_agent": user_agent}, status_code=200)
 
-# 直接 python app.py 运行（开发用）
+# 直接 python app.py 运行
 if __name__ == "__main__":
     import uvicorn
     logger.info("Starting uvicorn at 0.0.0.0:12082")
-    uvicorn.run("app:app", host="0.0.0.0", port=12082, reload=True)
+    # uvloop + httptools：C 实现的事件循环与 HTTP 解析器，避免回退到
+    # 纯 Python 的 asyncio + h11；reload 会强制 Python 循环，生产不开。
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=12082,
+        loop="uvloop",
+        http="httptools",
+        reload=False,
+        workers=os.cpu_count(),
+    )